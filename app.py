@@ -8,21 +8,31 @@ Features:
 - Real-time Face Recognition Attendance
 - Excel Report Generation for Absentees
 - Professional UI with Custom Styling
-- Data Persistence using Pickle/JSON
+- Data Persistence using NumPy (memory-mapped encodings) and JSON/JSONL
 
 Required Libraries:
-pip install streamlit face_recognition opencv-python pandas xlsxwriter pillow numpy
+pip install streamlit streamlit-webrtc face_recognition opencv-python pandas xlsxwriter numpy
+Optional (JIT-compiled face matching): pip install numba
 """
 
 import streamlit as st
+from streamlit_webrtc import webrtc_streamer
 import face_recognition
+import cv2
 import pandas as pd
 import numpy as np
 import os
 import io
+import queue
+import threading
 import pickle
+import json
 from datetime import datetime, date
-from PIL import Image
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
 
 # Page Configuration
 st.set_page_config(
@@ -125,12 +135,100 @@ def load_css():
     </style>
     """, unsafe_allow_html=True)
 
+def decode_image(buffer):
+    """Decodes an uploaded/captured image buffer straight into an RGB NumPy array."""
+    data = np.frombuffer(buffer.getvalue(), dtype=np.uint8)
+    image = cv2.imdecode(data, cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Could not decode the image file.")
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+# Maximum Euclidean distance between encodings that still counts as the same face
+MATCH_TOLERANCE = 0.6
+# Frames are only downscaled for detection while their short side stays at least this long
+MIN_DETECTION_SIDE = 480
+
+def _match_faces_loops(known, probes, tol2):
+    """Fused subtract/square/sum/argmin/threshold over every probe; compiled by Numba."""
+    n_probes = probes.shape[0]
+    n_known, dim = known.shape
+    best = np.zeros(n_probes, dtype=np.int32)
+    matched = np.zeros(n_probes, dtype=np.bool_)
+    for p in range(n_probes):
+        best_d2 = np.float32(1e30)
+        for k in range(n_known):
+            d2 = np.float32(0.0)
+            for j in range(dim):
+                diff = known[k, j] - probes[p, j]
+                d2 += diff * diff
+            if d2 < best_d2:
+                best_d2 = d2
+                best[p] = k
+        matched[p] = best_d2 <= tol2
+    return best, matched
+
+_match_faces_jit = njit(cache=True, fastmath=True)(_match_faces_loops) if njit else None
+
+def match_faces(known, probes, tol2):
+    """Returns the closest known row for each probe and whether it is within tolerance.
+    
+    Works on squared distances throughout (d <= tol iff d^2 <= tol^2), so no sqrt is
+    taken. `known` and `probes` must be C-contiguous float32.
+    """
+    if _match_faces_jit is not None:
+        return _match_faces_jit(known, probes, np.float32(tol2))
+    best = np.zeros(len(probes), dtype=np.intp)
+    matched = np.zeros(len(probes), dtype=bool)
+    for p, probe in enumerate(probes):
+        diff = known - probe
+        # einsum reduces in place, without the intermediate diff**2 array
+        d2 = np.einsum('ij,ij->i', diff, diff)
+        best[p] = d2.argmin()
+        matched[p] = d2[best[p]] <= tol2
+    return best, matched
+
+def _append_value(column, value):
+    return np.concatenate([column, np.array([value], dtype=object)])
+
+# dlib models that face_recognition loads at import; used directly on the hot path
+_face_detector = face_recognition.api.face_detector
+_face_encoder = face_recognition.api.face_encoder
+
+def encode_faces(image_array, face_locations, landmark_model="small"):
+    """128-d encodings for the given (top, right, bottom, left) boxes."""
+    landmarks = face_recognition.api._raw_face_landmarks(
+        image_array, face_locations, model=landmark_model
+    )
+    return [
+        np.array(_face_encoder.compute_face_descriptor(image_array, shape, 1))
+        for shape in landmarks
+    ]
+
+@st.cache_resource
+def warm_face_models():
+    """Runs the detector, both landmark predictors and the encoder once, as the
+    recognition and registration paths call them, so the first real frame is not slow."""
+    blank = np.zeros((100, 100, 3), dtype=np.uint8)
+    _face_detector(blank, 1)
+    for landmark_model in ("small", "large"):
+        encode_faces(blank, [(0, 100, 100, 0)], landmark_model)
+    return True
+
 # Data Management Functions
 class AttendanceData:
     def __init__(self):
         self.data_dir = "attendance_data"
-        self.students_file = os.path.join(self.data_dir, "students.pkl")
-        self.attendance_file = os.path.join(self.data_dir, "attendance.pkl")
+        # Bumped on every write; used as a cache key for derived report data
+        self.revision = 0
+        # Bumped only when student data is written (registration, reset)
+        self.students_revision = 0
+        # Guards the encoding index and records against the live recognition thread
+        self._lock = threading.RLock()
+        self.students_file = os.path.join(self.data_dir, "students.json")
+        self.encodings_file = os.path.join(self.data_dir, "encodings.npy")
+        self.legacy_students_file = os.path.join(self.data_dir, "students.pkl")
+        self.attendance_file = os.path.join(self.data_dir, "attendance.jsonl")
+        self.legacy_attendance_file = os.path.join(self.data_dir, "attendance.pkl")
         self.images_dir = os.path.join(self.data_dir, "student_images")
         
         os.makedirs(self.data_dir, exist_ok=True)
@@ -138,117 +236,342 @@ class AttendanceData:
         
         self.students = self.load_students()
         self.attendance_records = self.load_attendance()
+        self._presence = {}
+        self.rebuild_known_index()
+        self.rebuild_presence()
+    
+    def rebuild_known_index(self):
+        """Rebuilds the per-student columns from self.students (row i is student i).
+        
+        Students are stored column-wise, parallel to the encoding matrix `enc`, so
+        recognition touches only `enc` and reports filter with vectorized masks.
+        """
+        student_ids = list(self.students.keys())
+        self.ids = np.array(student_ids, dtype=object)
+        self.names = np.array([self.students[s]['name'] for s in student_ids], dtype=object)
+        self.classes = np.array([self.students[s]['class'] for s in student_ids], dtype=object)
+        self.emails = np.array([self.students[s]['email'] for s in student_ids], dtype=object)
+        self.reg_dates = np.array(
+            [self.students[s]['registration_date'] for s in student_ids], dtype=object
+        )
+        self.refresh_lookups()
+    
+    def refresh_lookups(self):
+        """Refreshes the indexes derived from the student columns."""
+        self._id_index = {student_id: i for i, student_id in enumerate(self.ids)}
+        self._class_rows = {c: np.flatnonzero(self.classes == c) for c in set(self.classes)}
+        # Per-class encoding shards, built lazily by known_for_class
+        self._class_known = {}
+        # New students are appended, so existing presence rows only need padding
+        count = len(self.ids)
+        if any(len(row) > count for row in self._presence.values()):
+            self.rebuild_presence()
+        else:
+            for date_str, row in self._presence.items():
+                self._presence[date_str] = np.pad(row, (0, count - len(row)))
+    
+    def class_names(self):
+        return sorted(self._class_rows)
+    
+    def class_indices(self, class_name):
+        """Row indices of the students in a class, or of everyone for "All Classes"."""
+        if class_name == "All Classes":
+            return np.arange(len(self.ids))
+        return self._class_rows.get(class_name, np.empty(0, dtype=np.intp))
     
+    def known_for_class(self, class_filter=None):
+        """Encodings and IDs to match against, optionally one class only."""
+        if class_filter in (None, "All Classes"):
+            return self.enc, self.ids
+        shard = self._class_known.get(class_filter)
+        if shard is None:
+            rows = self.class_indices(class_filter)
+            shard = (np.ascontiguousarray(self.enc[rows]), self.ids[rows])
+            self._class_known[class_filter] = shard
+        return shard
+
     def load_students(self):
-        if os.path.exists(self.students_file):
+        """Loads student metadata and memory-maps the (N, 128) encoding matrix."""
+        self.enc = np.empty((0, 128), dtype=np.float32)
+        self._stored_rows = 0
+        if os.path.exists(self.students_file) or os.path.exists(self.encodings_file):
+            # Never fall back to an empty store here: the next save would persist it
+            # and wipe every registered student
+            students = {}
+            encodings = self.enc
             try:
-                with open(self.students_file, 'rb') as f:
-                    return pickle.load(f)
-            except (pickle.UnpicklingError, EOFError):
-                return {}
+                if os.path.exists(self.students_file):
+                    with open(self.students_file, 'r') as f:
+                        students = json.load(f)
+                if os.path.exists(self.encodings_file):
+                    encodings = np.load(self.encodings_file, mmap_mode='r')
+            except (ValueError, OSError) as e:
+                raise RuntimeError(f"Could not load the student store in {self.data_dir}: {e}") from e
+            # save_students swaps the files so that len(encodings) >= len(students) holds at
+            # every crash point; any extra trailing rows belong to no student
+            self._stored_rows = len(encodings)
+            if len(encodings) < len(students):
+                raise RuntimeError(
+                    f"{self.encodings_file} has {len(encodings)} rows but "
+                    f"{self.students_file} lists {len(students)} students."
+                )
+            self.enc = encodings[:len(students)]
+            return students
+        if os.path.exists(self.legacy_students_file):
+            return self.migrate_legacy_students()
         return {}
     
+    def migrate_legacy_students(self):
+        """Converts the old students.pkl (encodings inside each dict) to the split store."""
+        try:
+            with open(self.legacy_students_file, 'rb') as f:
+                legacy = pickle.load(f)
+        except (pickle.UnpicklingError, EOFError):
+            return {}
+        students = {}
+        vectors = []
+        for student_id, data in legacy.items():
+            data = dict(data)
+            vectors.append(np.asarray(data.pop('face_encoding'), dtype=np.float32))
+            students[student_id] = data
+        if vectors:
+            self.enc = np.ascontiguousarray(np.stack(vectors), dtype=np.float32)
+        self.students = students
+        self.save_students()
+        return students
+    
     def save_students(self):
-        with open(self.students_file, 'wb') as f:
-            pickle.dump(self.students, f)
+        # Write both stores to temp files first, then swap them in atomically
+        students_tmp = self.students_file + '.tmp'
+        encodings_tmp = self.encodings_file + '.tmp'
+        with open(students_tmp, 'w') as f:
+            json.dump(self.students, f, indent=2)
+        with open(encodings_tmp, 'wb') as f:
+            np.save(f, np.ascontiguousarray(self.enc, dtype=np.float32))
+        # Keep len(encodings.npy) >= len(students.json) between the two swaps: when
+        # growing the matrix goes first, when shrinking (reset) the metadata goes first
+        if len(self.enc) >= self._stored_rows:
+            os.replace(encodings_tmp, self.encodings_file)
+            os.replace(students_tmp, self.students_file)
+        else:
+            os.replace(students_tmp, self.students_file)
+            os.replace(encodings_tmp, self.encodings_file)
+        self._stored_rows = len(self.enc)
+    
+    def clear_students(self):
+        with self._lock:
+            self.students = {}
+            self.enc = np.empty((0, 128), dtype=np.float32)
+            self.save_students()
+            self.rebuild_known_index()
+            self._bump_revision(students=True)
     
     def load_attendance(self):
+        records = []
         if os.path.exists(self.attendance_file):
+            with open(self.attendance_file, 'r') as f:
+                lines = f.readlines()
+            # Only the last line can be torn by an interrupted append
+            torn = bool(lines) and not lines[-1].endswith('\n')
+            for line_num, line in enumerate(lines, start=1):
+                try:
+                    records.append(json.loads(line))
+                except ValueError as e:
+                    if line_num == len(lines):
+                        torn = True
+                        continue
+                    raise RuntimeError(
+                        f"{self.attendance_file} line {line_num} is corrupt: {e}"
+                    ) from e
+            if torn:
+                # Rewrite the log so the next append doesn't land on the partial line
+                self.attendance_records = records
+                self.save_attendance()
+        elif os.path.exists(self.legacy_attendance_file):
             try:
-                with open(self.attendance_file, 'rb') as f:
-                    return pickle.load(f)
+                with open(self.legacy_attendance_file, 'rb') as f:
+                    records = pickle.load(f)
             except (pickle.UnpicklingError, EOFError):
-                return []
-        return []
+                records = []
+            self.attendance_records = records
+            self.save_attendance()
+        return records
+    
+    def rebuild_presence(self):
+        """Builds one boolean row per date, indexed like the encoding matrix."""
+        self._presence = {}
+        for r in self.attendance_records:
+            self._mark_present(r['student_id'], r['date'])
+    
+    def _mark_present(self, student_id, date_str):
+        index = self._id_index.get(student_id)
+        if index is None:
+            return
+        row = self._presence.get(date_str)
+        if row is None:
+            row = self._presence[date_str] = np.zeros(len(self.ids), dtype=bool)
+        row[index] = True
+    
+    def presence_row(self, date_str):
+        """Boolean presence for every known student on a date (row i is student i)."""
+        row = self._presence.get(date_str)
+        if row is None:
+            return np.zeros(len(self.ids), dtype=bool)
+        return row
+    
+    def is_present(self, student_id, date_str):
+        index = self._id_index.get(student_id)
+        return index is not None and bool(self.presence_row(date_str)[index])
+    
+    def clear_attendance(self):
+        with self._lock:
+            self.attendance_records = []
+            self._presence = {}
+            self.save_attendance()
+            self._bump_revision()
     
     def save_attendance(self):
-        with open(self.attendance_file, 'wb') as f:
-            pickle.dump(self.attendance_records, f)
+        with open(self.attendance_file, 'w') as f:
+            for record in self.attendance_records:
+                f.write(json.dumps(record) + '\n')
+    
+    def _append_record(self, record):
+        """Appends one record to memory and the log without rewriting the file."""
+        with self._lock:
+            self.attendance_records.append(record)
+            self._mark_present(record['student_id'], record['date'])
+            with open(self.attendance_file, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+            self._bump_revision()
+    
+    def _bump_revision(self, students=False):
+        """Call last and under the lock, once the new data is fully in place."""
+        self.revision += 1
+        if students:
+            self.students_revision += 1
+    
+    def detect_faces(self, image_array, scale=1.0):
+        """Runs the HOG detector at `scale` and returns (top, right, bottom, left) boxes
+        in full-resolution coordinates."""
+        if scale < 1.0:
+            detect_on = cv2.resize(image_array, (0, 0), fx=scale, fy=scale)
+        else:
+            detect_on = image_array
+        upscale = 1 / scale
+        height, width = image_array.shape[:2]
+        return [
+            (max(int(rect.top() * upscale), 0), min(int(rect.right() * upscale), width),
+             min(int(rect.bottom() * upscale), height), max(int(rect.left() * upscale), 0))
+            for rect in _face_detector(detect_on, 1)
+        ]
+    
+    def compute_face_encodings(self, image_array, downscale=True, landmark_model="small"):
+        """Detects faces (on a downscaled copy for large frames), then encodes them at
+        full resolution.
+        
+        Downscaling keeps the short side at MIN_DETECTION_SIDE or more, so small faces stay
+        above the HOG detector's ~80 px minimum; if nothing is found there, detection is
+        retried at full resolution.
+        landmark_model="small" aligns with the 5-point predictor (cheap, used per frame);
+        "large" uses the 68-point predictor, kept for one-off registrations.
+        """
+        scale = 1.0
+        if downscale:
+            scale = min(1.0, MIN_DETECTION_SIDE / min(image_array.shape[:2]))
+        face_locations = self.detect_faces(image_array, scale)
+        if not face_locations and scale < 1.0:
+            face_locations = self.detect_faces(image_array)
+        if not face_locations:
+            return []
+        return encode_faces(image_array, face_locations, landmark_model)
     
-    # --- FIX APPLIED HERE: Changed to take image_array instead of path ---
     def generate_face_encoding(self, image_array):
         """Generates face encoding from a NumPy image array."""
         try:
-            # face_recognition works directly with the NumPy array
-            encodings = face_recognition.face_encodings(image_array)
+            # Registration is rare, so detect at full resolution for the best chance of a hit
+            encodings = self.compute_face_encodings(
+                image_array, downscale=False, landmark_model="large"
+            )
             if encodings:
-                return encodings[0]
+                # float32 halves the bytes streamed per row during matching
+                return np.asarray(encodings[0], dtype=np.float32)
         except Exception as e:
             st.error(f"Error processing face: {str(e)}")
         return None
     
-    # --- FIX APPLIED HERE: Handles PIL to NumPy conversion and encoding generation ---
-    def register_student(self, student_id, name, class_name, email, image):
+    def register_student(self, student_id, name, class_name, email, image_array):
+        """Registers a student from an RGB NumPy array (see decode_image)."""
         image_path = os.path.join(self.images_dir, f"{student_id}.jpg")
         
-        # 1. Ensure image is RGB (critical for face_recognition)
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        # 2. Convert to NumPy array for face processing
-        image_array = np.array(image)
-        
-        # 3. Generate encoding directly from the array
+        # 1. Generate encoding directly from the array
         face_encoding = self.generate_face_encoding(image_array)
         
         if face_encoding is not None:
-            # 4. Save the image (for display/reload later)
-            image.save(image_path)
+            # 2. Save the image (for display/reload later); OpenCV writes BGR
+            cv2.imwrite(image_path, cv2.cvtColor(image_array, cv2.COLOR_RGB2BGR))
             
-            self.students[student_id] = {
-                'name': name, 'class': class_name, 'email': email,
-                'image_path': image_path, 'face_encoding': face_encoding,
-                'registration_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            }
-            self.save_students()
+            # The JPEG is kept for display only; matching uses the encoding matrix
+            registration_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            with self._lock:
+                self.students[student_id] = {
+                    'name': name, 'class': class_name, 'email': email,
+                    'image_path': image_path, 'registration_date': registration_date
+                }
+                self.enc = np.concatenate([self.enc, face_encoding[np.newaxis, :]])
+                self.ids = _append_value(self.ids, student_id)
+                self.names = _append_value(self.names, name)
+                self.classes = _append_value(self.classes, class_name)
+                self.emails = _append_value(self.emails, email)
+                self.reg_dates = _append_value(self.reg_dates, registration_date)
+                # Pad presence rows and rebuild lookups before the file I/O in save_students
+                self.refresh_lookups()
+                self.save_students()
+                self._bump_revision(students=True)
             return True
         return False
     
-    def mark_attendance(self, image):
-        try:
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            image_array = np.array(image)
-            face_encodings = face_recognition.face_encodings(image_array)
-            marked_students = []
-            
-            for face_encoding in face_encodings:
-                known_encodings = [data['face_encoding'] for data in self.students.values()]
-                if not known_encodings:
-                    return []
-                    
-                matches = face_recognition.compare_faces(known_encodings, face_encoding, tolerance=0.6)
-                face_distances = face_recognition.face_distance(known_encodings, face_encoding)
-                best_match_index = np.argmin(face_distances)
-
-                if matches[best_match_index]:
-                    student_id = list(self.students.keys())[best_match_index]
-                    student_data = self.students[student_id]
-                    today = date.today().strftime("%Y-%m-%d")
-                    already_marked = any(
-                        r['student_id'] == student_id and r['date'] == today for r in self.attendance_records
-                    )
-                    
-                    if not already_marked:
-                        self.attendance_records.append({
-                            'student_id': student_id, 'name': student_data['name'],
-                            'class': student_data['class'], 'date': today,
-                            'time': datetime.now().strftime("%H:%M:%S"), 'status': 'Present'
-                        })
-                        marked_students.append(student_data['name'])
-
-            if marked_students:
-                self.save_attendance()
-                return list(set(marked_students))
-        except Exception as e:
-            st.error(f"Error in face recognition: {str(e)}")
-        return []
+    def mark_attendance(self, image_array, class_filter=None):
+        """Marks every recognized, not-yet-present student; safe to call off the script thread.
+        
+        With a class_filter only that class's encodings are searched.
+        """
+        face_encodings = self.compute_face_encodings(image_array)
+        marked_students = []
+        
+        with self._lock:
+            known, ids = self.known_for_class(class_filter)
+        if len(ids) == 0 or not face_encodings:
+            return []
+        
+        probes = np.ascontiguousarray(face_encodings, dtype=np.float32)
+        best_indices, matched = match_faces(
+            np.ascontiguousarray(known, dtype=np.float32), probes, MATCH_TOLERANCE ** 2
+        )
+        
+        for best_match_index, is_match in zip(best_indices, matched):
+            if is_match:
+                student_id = ids[best_match_index]
+                today = date.today().strftime("%Y-%m-%d")
+                
+                with self._lock:
+                    # The student may have been removed by a reset since the snapshot
+                    student_data = self.students.get(student_id)
+                    if student_data is None or self.is_present(student_id, today):
+                        continue
+                    self._append_record({
+                        'student_id': student_id, 'name': student_data['name'],
+                        'class': student_data['class'], 'date': today,
+                        'time': datetime.now().strftime("%H:%M:%S"), 'status': 'Present'
+                    })
+                marked_students.append(student_data['name'])
+
+        return list(set(marked_students))
 
     def get_attendance_stats(self):
         today = date.today().strftime("%Y-%m-%d")
-        present_today_ids = {r['student_id'] for r in self.attendance_records if r['date'] == today}
-        total_students = len(self.students)
-        present_count = len(present_today_ids)
+        with self._lock:
+            total_students = len(self.students)
+            present_count = int(self.presence_row(today).sum())
         return {
             'total_students': total_students,
             'present_today': present_count,
@@ -258,10 +581,75 @@ class AttendanceData:
 
 @st.cache_resource
 def get_data_manager():
+    warm_face_models()
     return AttendanceData()
 
 data_manager = get_data_manager()
 
+class RecognitionWorker:
+    """Runs face recognition on live video frames in a background thread.
+    
+    The video callback only hands frames over; if the worker is still busy the
+    frame is dropped, so recognition never backs up behind the camera. The thread
+    is started by the first frame and exits on stop() or once frames stop arriving
+    (stream stopped, page left or browser closed).
+    """
+    IDLE_TIMEOUT = 10.0
+    
+    def __init__(self, manager):
+        self.manager = manager
+        self.class_filter = None
+        self.frames = queue.Queue(maxsize=1)
+        self.results = queue.Queue()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def submit(self, image_array):
+        with self._lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        try:
+            self.frames.put_nowait(image_array)
+        except queue.Full:
+            pass
+    
+    def stop(self):
+        self._stop.set()
+    
+    def video_frame_callback(self, frame):
+        # Skip the RGB copy entirely for frames submit() would drop anyway; still submit
+        # when no thread is running so a stale queued frame can't block a restart
+        if self._thread is None or not self.frames.full():
+            self.submit(frame.to_ndarray(format="rgb24"))
+        return frame
+    
+    def _run(self):
+        idle = 0.0
+        while not self._stop.is_set():
+            try:
+                image_array = self.frames.get(timeout=1.0)
+            except queue.Empty:
+                idle += 1.0
+                with self._lock:
+                    # Checked under the lock so a concurrent submit() either sees
+                    # this thread alive or starts a new one
+                    if idle >= self.IDLE_TIMEOUT and self.frames.empty():
+                        self._thread = None
+                        return
+                continue
+            idle = 0.0
+            try:
+                marked = self.manager.mark_attendance(image_array, self.class_filter)
+                if marked:
+                    self.results.put((marked, None))
+            except Exception as e:
+                self.results.put(([], str(e)))
+        with self._lock:
+            self._thread = None
+
 def main():
     load_css()
     st.markdown("""
@@ -336,12 +724,11 @@ def student_registration_page():
                     st.error("❌ Please provide a photo!")
                 else:
                     try:
-                        # Image.open() reads the uploaded file buffer
-                        image = Image.open(image_buffer) 
+                        # Decode the uploaded file buffer straight to an RGB array
+                        image_array = decode_image(image_buffer)
                         with st.spinner("🔄 Processing registration..."):
-                            # Pass the PIL image object to the manager
                             success = data_manager.register_student(
-                                student_id.strip(), name.strip(), class_name, email.strip(), image
+                                student_id.strip(), name.strip(), class_name, email.strip(), image_array
                             )
                         
                         if success:
@@ -378,37 +765,73 @@ def mark_attendance_page():
         st.subheader("📷 Live Attendance Capture")
         st.markdown("""
         *Instructions:*
-        1. Click 'Take Photo' button below.
+        1. Click 'Start' below to open the camera.
         2. Position face(s) clearly in the camera frame.
         3. The system will automatically recognize and mark attendance.
         """)
-        camera_image = st.camera_input("📸 Capture for Attendance", label_visibility="collapsed")
+        st.selectbox(
+            "Class for this session", ["All Classes"] + data_manager.class_names(), key="session_class"
+        )
+        # One worker per browser session; the callback runs on the WebRTC thread and
+        # the worker's thread only exists while frames are arriving
+        if "recognition_worker" not in st.session_state:
+            st.session_state.recognition_worker = RecognitionWorker(data_manager)
+        worker = st.session_state.recognition_worker
+        worker.class_filter = st.session_state.session_class
+        ctx = webrtc_streamer(
+            key="attendance-camera",
+            video_frame_callback=worker.video_frame_callback,
+            media_stream_constraints={"video": True, "audio": False},
+        )
         
-        if camera_image:
-            with st.spinner("🔍 Recognizing faces..."):
-                image = Image.open(camera_image)
-                marked_students = data_manager.mark_attendance(image)
-            
-            if marked_students:
-                st.success(f"✅ Attendance marked for: {', '.join(marked_students)}")
-                st.balloons()
-            else:
-                st.warning("⚠️ No new registered students were recognized, or they were already marked present.")
+        if st.session_state.get("last_marked"):
+            st.success(f"✅ Attendance marked for: {', '.join(st.session_state.last_marked)}")
+            st.balloons()
+            st.session_state.last_marked = None
+        if ctx.state.playing:
+            poll_recognition_results(worker)
+        else:
+            worker.stop()
         st.markdown('</div>', unsafe_allow_html=True)
     
     with col2:
         st.markdown('<div class="info-card">', unsafe_allow_html=True)
         st.subheader("📊 Today's Attendance")
         today = date.today().strftime("%Y-%m-%d")
-        today_attendance = [r for r in data_manager.attendance_records if r['date'] == today]
+        df = todays_attendance(data_manager, today, data_manager.revision)
         
-        if today_attendance:
-            df = pd.DataFrame(today_attendance)
-            st.dataframe(df[['name', 'class', 'time']], use_container_width=True)
+        if not df.empty:
+            st.dataframe(df, use_container_width=True)
         else:
             st.info("📝 No attendance marked today yet.")
         st.markdown('</div>', unsafe_allow_html=True)
 
+@st.fragment(run_every=1.0)
+def poll_recognition_results(worker):
+    # Only this fragment reruns each second; the full page reruns when someone new is marked
+    marked_students = []
+    while True:
+        try:
+            marked, error = worker.results.get_nowait()
+        except queue.Empty:
+            break
+        marked_students.extend(marked)
+        if error:
+            st.session_state.recognition_error = error
+    if st.session_state.get("recognition_error"):
+        st.error(f"Error in face recognition: {st.session_state.recognition_error}")
+    if marked_students:
+        st.session_state.recognition_error = None
+        st.session_state.last_marked = sorted(set(marked_students))
+        st.rerun()
+
+@st.cache_data(max_entries=2)
+def todays_attendance(_data_manager, today, revision):
+    # `revision` is only a cache key: it changes whenever a record is appended or cleared
+    with _data_manager._lock:
+        records = [r for r in _data_manager.attendance_records if r['date'] == today]
+    return pd.DataFrame(records, columns=['name', 'class', 'time'])
+
 def attendance_reports_page():
     st.header("📊 Attendance Reports")
     col1, col2 = st.columns([2, 1])
@@ -416,7 +839,7 @@ def attendance_reports_page():
         st.markdown('<div class="info-card">', unsafe_allow_html=True)
         st.subheader("📅 Report Filters")
         selected_date = st.date_input("Select Date", value=date.today())
-        classes = ["All Classes"] + sorted(list(set(s['class'] for s in data_manager.students.values())))
+        classes = ["All Classes"] + data_manager.class_names()
         selected_class = st.selectbox("Filter by Class", classes)
         report_type = st.selectbox("Report Type", ["Absentees Only", "All Students Status"])
         st.markdown('</div>', unsafe_allow_html=True)
@@ -424,21 +847,11 @@ def attendance_reports_page():
     with col1:
         st.markdown('<div class="info-card">', unsafe_allow_html=True)
         date_str = selected_date.strftime("%Y-%m-%d")
-        present_students = {r['student_id'] for r in data_manager.attendance_records if r['date'] == date_str}
-        
-        report_data = []
-        for student_id, student_data in data_manager.students.items():
-            if selected_class == "All Classes" or student_data['class'] == selected_class:
-                status = 'Present' if student_id in present_students else 'Absent'
-                report_data.append({
-                    'Student ID': student_id, 'Name': student_data['name'],
-                    'Class': student_data['class'], 'Status': status
-                })
+        df = build_report(data_manager, date_str, selected_class, data_manager.revision)
         
-        if not report_data:
+        if df.empty:
             st.warning("No students found for the selected filter.")
         else:
-            df = pd.DataFrame(report_data)
             if report_type == "Absentees Only":
                 df = df[df['Status'] == 'Absent']
                 st.subheader(f"❌ Absentees for {selected_date.strftime('%B %d, %Y')}")
@@ -458,20 +871,39 @@ def attendance_reports_page():
                 )
         st.markdown('</div>', unsafe_allow_html=True)
 
+@st.cache_data(max_entries=4)
+def build_report(_data_manager, date_str, class_filter, revision):
+    # `revision` is only a cache key: it changes whenever students or records are written
+    # Columns and presence rows must come from the same registration state
+    with _data_manager._lock:
+        rows = _data_manager.class_indices(class_filter)
+        present = _data_manager.presence_row(date_str)[rows]
+        ids, names, classes = _data_manager.ids[rows], _data_manager.names[rows], _data_manager.classes[rows]
+    return pd.DataFrame({
+        'Student ID': ids, 'Name': names,
+        'Class': classes, 'Status': np.where(present, 'Present', 'Absent')
+    })
+
+@st.cache_data(max_entries=4)
 def create_excel_report(df, sheet_name):
     buffer = io.BytesIO()
-    with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
-        df.to_excel(writer, sheet_name=sheet_name, index=False)
+    options = {'constant_memory': True}
+    with pd.ExcelWriter(buffer, engine='xlsxwriter', engine_kwargs={'options': options}) as writer:
         workbook = writer.book
-        worksheet = writer.sheets[sheet_name]
+        worksheet = workbook.add_worksheet(sheet_name)
         header_format = workbook.add_format({
             'bold': True, 'text_wrap': True, 'valign': 'top',
             'fg_color': '#4CAF50', 'font_color': 'white', 'border': 1
         })
+        # One pass over the frame for every column's widest cell
+        widths = df.astype(str).apply(lambda s: s.str.len()).max().fillna(0).to_numpy()
+        # constant_memory flushes each row as soon as the next one starts, so widths
+        # are set first and rows are written exactly once, top to bottom
         for col_num, value in enumerate(df.columns.values):
-            worksheet.write(0, col_num, value, header_format)
-            max_len = max(df[value].astype(str).str.len().max(), len(value)) + 2
-            worksheet.set_column(col_num, col_num, max_len)
+            worksheet.set_column(col_num, col_num, max(int(widths[col_num]), len(value)) + 2)
+        worksheet.write_row(0, 0, df.columns.values, header_format)
+        for row_num, row in enumerate(df.itertuples(index=False), start=1):
+            worksheet.write_row(row_num, 0, row)
     return buffer.getvalue()
 
 def system_settings_page():
@@ -487,8 +919,7 @@ def system_settings_page():
         st.subheader("🗂 Data Management")
         
         if st.button("🧹 Clear All Attendance Records", use_container_width=True):
-            data_manager.attendance_records = []
-            data_manager.save_attendance()
+            data_manager.clear_attendance()
             st.success("✅ Attendance records cleared!")
             st.rerun()
         
@@ -501,10 +932,8 @@ def system_settings_page():
             st.warning("This is irreversible. Are you sure you want to delete all students and records?")
             c1, c2 = st.columns(2)
             if c1.button("YES, I AM SURE", use_container_width=True):
-                data_manager.students = {}
-                data_manager.attendance_records = []
-                data_manager.save_students()
-                data_manager.save_attendance()
+                data_manager.clear_students()
+                data_manager.clear_attendance()
                 # Also delete image files
                 try:
                     for f in os.listdir(data_manager.images_dir):
@@ -524,14 +953,17 @@ def system_settings_page():
         st.markdown('<div class="info-card">', unsafe_allow_html=True)
         st.subheader("👥 Registered Students")
         if data_manager.students:
-            students_df = pd.DataFrame([
-                {'ID': student_id, 'Name': data['name'], 'Class': data['class']}
-                for student_id, data in data_manager.students.items()
-            ])
+            students_df = students_table(data_manager, data_manager.students_revision)
             st.dataframe(students_df, use_container_width=True)
         else:
             st.info("📝 No students registered yet.")
         st.markdown('</div>', unsafe_allow_html=True)
 
+@st.cache_data(max_entries=2)
+def students_table(_data_manager, students_revision):
+    with _data_manager._lock:
+        ids, names, classes = _data_manager.ids, _data_manager.names, _data_manager.classes
+    return pd.DataFrame({'ID': ids, 'Name': names, 'Class': classes})
+
 if __name__ == "__main__":
     main()
\ No newline at end of file